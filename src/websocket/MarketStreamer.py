@@ -5,13 +5,157 @@ MarketStreamer.py - WebSocket клиент для получения реаль
 import asyncio
 import json
 import logging
-from typing import Dict, List, Callable, Optional, Any
+import os
+import socket
+from typing import Dict, List, Callable, Optional, Any, Tuple
 import websockets
-import ccxt.pro as ccxtpro
-from datetime import datetime
+import orjson
+from datetime import datetime, timezone
+from functools import lru_cache
+from time import time_ns
 import threading
-from queue import Queue
-import pandas as pd
+from collections import defaultdict, deque
+from itertools import count, islice
+import numpy as np
+
+
+# Логгер модуля: горячий путь обращается к нему напрямую, без self.logger
+_log = logging.getLogger(__name__)
+
+# Максимальный размер очереди принятых, но еще не обработанных сообщений
+RX_QUEUE_SIZE = 10000
+
+# Количество хранимых уровней стакана на каждую сторону
+ORDERBOOK_DEPTH = 64
+
+# Сколько свечей хранить в кеше на каждый символ/интервал
+KLINE_HISTORY = 1000
+
+# Сколько последних сделок хранить в кеше на каждый символ
+TRADE_HISTORY = 4096
+
+# Параметры соединения: max_queue=None снимает ограничение внутренней
+# очереди websockets, которая иначе притормаживает recv при всплесках
+WS_CONNECT_OPTIONS = {
+    'ping_interval': 20,
+    'ping_timeout': 10,
+    'close_timeout': 2,
+    'max_queue': None
+}
+
+# Размер буфера приема сокета, сглаживает всплески сообщений
+SOCKET_RCVBUF = 4 * 1024 * 1024
+
+# Задержка переподключения (сек), удваивается после каждой неудачи
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 60
+
+# Минимальный интервал между рассылками колбэков для частых потоков (нс).
+# Кеш обновляется на каждом сообщении, пропускаются только вызовы колбэков
+ORDERBOOK_THROTTLE_NS = 100_000_000
+TICKER_THROTTLE_NS = 500_000_000
+
+# Окно накопления сообщений для пакетных подписчиков (сек)
+BATCH_WINDOW = 0.01
+
+# Способ вызова колбэка: синхронно через call_soon, корутина через очередь,
+# синхронно пачкой накопленных за BATCH_WINDOW сообщений
+_CB_SYNC = 0
+_CB_ASYNC = 1
+_CB_BATCH = 2
+
+
+@lru_cache(maxsize=1024)
+def _kline_key(exchange: str, symbol: str, interval: str) -> str:
+    """Ключ кеша свечей (binance_btcusdt_1m); строки мемоизируются для горячего пути"""
+    return f"{exchange}_{symbol.lower()}_{interval}"
+
+
+@lru_cache(maxsize=1024)
+def _stream_key(exchange: str, prefix: str, symbol: str) -> str:
+    """Ключ кеша потока вида binance_trades_btcusdt, bybit_ticker_btcusdt"""
+    return f"{exchange}_{prefix}_{symbol.lower()}"
+
+
+@lru_cache(maxsize=1024)
+def _route_key(exchange: str, symbol: str, stream_type: str) -> str:
+    """Ключ, под которым обработчики публикуют поток подписки (он же ключ data_cache)
+
+    Биржа входит в ключ: одинаковые символы разных бирж не смешиваются.
+    """
+    if stream_type.startswith('kline_'):
+        return _kline_key(exchange, symbol, stream_type[len('kline_'):])
+    if stream_type.startswith('depth'):
+        return _stream_key(exchange, 'orderbook', symbol)
+    if stream_type == 'trade':
+        return _stream_key(exchange, 'trades', symbol)
+    if stream_type == 'tickers':
+        return _stream_key(exchange, 'ticker', symbol)
+    return _stream_key(exchange, stream_type, symbol)
+
+
+def _exchange_stream(exchange: str, symbol: str, stream_type: str) -> Optional[str]:
+    """Имя потока биржи для подписки (btcusdt@kline_1m, kline.1.BTCUSDT)"""
+    if exchange == 'binance':
+        return f"{symbol.lower()}@{stream_type}"
+    if exchange == 'bybit':
+        if stream_type.startswith('kline_'):
+            return f"kline.{stream_type[len('kline_'):]}.{symbol.upper()}"
+        if stream_type in ('ticker', 'tickers'):
+            return f"tickers.{symbol.upper()}"
+    return None
+
+
+def _parse_levels(levels: List) -> np.ndarray:
+    """Уровни стакана [[цена, объем], ...] в массив float64 формы (N, 2)"""
+    return np.asarray(levels[:ORDERBOOK_DEPTH], dtype=np.float64).reshape(-1, 2)
+
+
+# Стороны стакана до первого обновления
+_EMPTY_BOOK = {'bids': _parse_levels([]), 'asks': _parse_levels([])}
+
+
+class TradeBuffer:
+    """Кольцевой буфер сделок в виде параллельных массивов (по колонке на поле)"""
+    
+    def __init__(self, size: int = TRADE_HISTORY):
+        self.size = size
+        self.timestamp_ms = np.zeros(size, dtype=np.int64)
+        self.price = np.zeros(size, dtype=np.float64)
+        self.quantity = np.zeros(size, dtype=np.float64)
+        self.is_buyer_maker = np.zeros(size, dtype=bool)
+        self.time_str = np.empty(size, dtype=object)
+        self.head = 0  # Сколько сделок записано всего
+    
+    def __len__(self) -> int:
+        return min(self.head, self.size)
+    
+    def append(self, trade: Dict):
+        """Запись сделки в следующий слот"""
+        i = self.head % self.size
+        self.timestamp_ms[i] = trade['timestamp_ms']
+        self.price[i] = trade['price']
+        self.quantity[i] = trade['quantity']
+        self.is_buyer_maker[i] = trade['is_buyer_maker']
+        self.time_str[i] = trade['time_str']
+        self.head += 1
+    
+    def tail(self, limit: int) -> Dict[str, np.ndarray]:
+        """Последние limit сделок по колонкам в хронологическом порядке"""
+        head = self.head
+        index = np.arange(max(head - limit, head - self.size, 0), head) % self.size
+        return {
+            'timestamp_ms': self.timestamp_ms[index],
+            'price': self.price[index],
+            'quantity': self.quantity[index],
+            'is_buyer_maker': self.is_buyer_maker[index],
+            'time_str': self.time_str[index]
+        }
+    
+    def records(self, limit: int) -> List[Dict]:
+        """Последние limit сделок списком словарей"""
+        columns = {key: values.tolist() for key, values in self.tail(limit).items()}
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
 
 
 class MarketStreamer:
@@ -19,16 +163,53 @@ class MarketStreamer:
     
     def __init__(self):
         self.logger = self._setup_logger()
+        # Одно соединение на биржу (binance, bybit) и список потоков,
+        # на которые оно подписано; новые потоки досылаются в то же соединение
         self.connections: Dict[str, Any] = {}
+        # TCP_NODELAY на сокетах бирж: False включает алгоритм Нейгла обратно
+        self.tcp_nodelay = True
         self.subscriptions: Dict[str, List[str]] = {}
-        self.callbacks: Dict[str, List[Callable]] = {}
+        self._request_ids = count(1)
+        # Колбэки хранятся в упорядоченном dict (callback -> способ вызова _CB_*):
+        # добавление и удаление за O(1), порядок вызова сохраняется
+        self.callbacks: Dict[str, Dict[Callable, int]] = {}
+        # Маршрутизация: ключ данных -> целочисленный id -> снимок колбэков
+        # ((callback, способ вызова), ...), собранный при подписке
+        self._stream_routes: Dict[str, str] = {}
+        self._route_ids: Dict[str, int] = {}
+        self._routes: List[Tuple[Tuple[Callable, int], ...]] = []
+        # Снимки для читателей из других потоков (панель статуса): кортеж
+        # потоков и их число заменяются целиком при (от)подписке
+        self.active_streams: Tuple[str, ...] = ()
+        self.sub_count = 0
         self.data_cache: Dict[str, Any] = {}
+        # Счетчик изменений по ключу data_cache: читатели сравнивают его
+        # с последним увиденным значением, чтобы не пересобирать то же самое
+        self.versions: Dict[str, int] = defaultdict(int)
+        self._cb_queues: Dict[str, asyncio.Queue] = {}
+        self._cb_workers: Dict[str, asyncio.Task] = {}
+        self._batches: Dict[str, List[Any]] = {}
+        self._throttle_ns: Dict[str, int] = {}
         self.running = False
         self.event_loop = None
+        self._stop_event: Optional[asyncio.Event] = None
         self.thread = None
         
+        # Обработчики сообщений по типу события (Binance) и топику (Bybit),
+        # собираются один раз вместо цепочки if/elif на каждое сообщение
+        self._binance_handlers: Dict[str, Callable] = {
+            'kline': self._process_kline,            # Свечные данные
+            'trade': self._process_trade,            # Торги
+            'depthUpdate': self._process_orderbook,  # Стакан ордеров
+            '24hrTicker': self._process_ticker       # 24-часовой тикер
+        }
+        self._bybit_handlers: Dict[str, Callable] = {
+            'kline': self._process_bybit_kline,
+            'tickers': self._process_bybit_ticker
+        }
+        
     def _setup_logger(self) -> logging.Logger:
-        logger = logging.getLogger(self.__class__.__name__)
+        logger = _log
         logger.setLevel(logging.INFO)
         
         if not logger.handlers:
@@ -42,137 +223,211 @@ class MarketStreamer:
         return logger
     
     async def connect_binance_ws(self, streams: List[str]):
-        """Подключение к WebSocket Binance"""
-        try:
-            # Публичный WebSocket Binance
-            url = f"wss://stream.binance.com:9443/ws"
-            
-            # Подписка на несколько потоков
-            params = {
-                "method": "SUBSCRIBE",
-                "params": streams,
-                "id": 1
-            }
-            
-            async with websockets.connect(url) as websocket:
-                await websocket.send(json.dumps(params))
-                
-                self.logger.info(f"Connected to Binance WebSocket, streams: {streams}")
-                
-                while self.running:
-                    try:
-                        message = await websocket.recv()
-                        data = json.loads(message)
-                        
-                        # Обработка разных типов данных
-                        if 'e' in data:  # Тип события
-                            event_type = data['e']
-                            
-                            if event_type == 'kline':  # Свечные данные
-                                await self._process_kline(data)
-                            elif event_type == 'trade':  # Торги
-                                await self._process_trade(data)
-                            elif event_type == 'depthUpdate':  # Стакан ордеров
-                                await self._process_orderbook(data)
-                            elif event_type == '24hrTicker':  # 24-часовой тикер
-                                await self._process_ticker(data)
-                        
-                    except Exception as e:
-                        self.logger.error(f"Error receiving WebSocket data: {e}")
-                        break
-                        
-        except Exception as e:
-            self.logger.error(f"Failed to connect to Binance WebSocket: {e}")
+        """Подключение к WebSocket Binance
+
+        Комбинированный endpoint /stream: все потоки идут через одно
+        соединение, каждое сообщение приходит как {"stream": ..., "data": ...}.
+        """
+        url = "wss://stream.binance.com:9443/stream"
+        self._add_streams('binance', streams)
+        
+        async def on_open(websocket):
+            await self._send_subscribe('binance', self.subscriptions['binance'])
+            _log.info("Connected to Binance WebSocket, streams: %s", self.subscriptions['binance'])
+        
+        await self._run_connection('binance', url, "Binance", on_open, self._handle_binance_message)
     
     async def connect_bybit_ws(self, streams: List[str]):
-        """Подключение к WebSocket Bybit"""
+        """Подключение к WebSocket Bybit (потоки - топики вида kline.1.BTCUSDT)"""
+        url = "wss://stream.bybit.com/v5/public/spot"
+        self._add_streams('bybit', streams)
+        
+        async def on_open(websocket):
+            await self._send_subscribe('bybit', self.subscriptions['bybit'])
+            _log.info("Connected to Bybit WebSocket, streams: %s", self.subscriptions['bybit'])
+        
+        await self._run_connection('bybit', url, "Bybit", on_open, self._handle_bybit_message)
+    
+    def _add_streams(self, exchange: str, streams: List[str]) -> List[str]:
+        """Добавление потоков в список подписок биржи, возвращает новые"""
+        subscribed = self.subscriptions.setdefault(exchange, [])
+        added = [stream for stream in dict.fromkeys(streams) if stream not in subscribed]
+        subscribed.extend(added)
+        return added
+    
+    async def _send_subscribe(self, exchange: str, streams: List[str]):
+        """Отправка запроса подписки в открытое соединение биржи"""
+        websocket = self.connections.get(exchange)
+        if websocket is None or not streams:
+            # Соединение еще не открыто: потоки уйдут при подключении
+            return
+        
         try:
-            url = "wss://stream.bybit.com/v5/public/spot"
-            
-            # Создаем подписки
-            subscriptions = []
-            for stream in streams:
-                if 'kline' in stream:
-                    symbol = stream.split('_')[0]
-                    interval = stream.split('_')[1]
-                    subscriptions.append(f"kline.{interval}.{symbol}")
-                elif 'tickers' in stream:
-                    symbol = stream.replace('tickers.', '')
-                    subscriptions.append(f"tickers.{symbol}")
-            
-            async with websockets.connect(url) as websocket:
-                # Подписываемся на все потоки
-                for sub in subscriptions:
-                    subscribe_msg = {
-                        "op": "subscribe",
-                        "args": [sub]
-                    }
-                    await websocket.send(json.dumps(subscribe_msg))
-                
-                self.logger.info(f"Connected to Bybit WebSocket, streams: {subscriptions}")
-                
-                while self.running:
-                    try:
-                        message = await websocket.recv()
-                        data = json.loads(message)
-                        
-                        if data.get('topic', '').startswith('kline'):
-                            await self._process_bybit_kline(data)
-                        elif data.get('topic', '').startswith('tickers'):
-                            await self._process_bybit_ticker(data)
-                            
-                    except Exception as e:
-                        self.logger.error(f"Error receiving Bybit WebSocket data: {e}")
-                        break
-                        
+            if exchange == 'binance':
+                await websocket.send(json.dumps({
+                    "method": "SUBSCRIBE",
+                    "params": list(streams),
+                    "id": next(self._request_ids)
+                }))
+            else:
+                for stream in streams:
+                    await websocket.send(json.dumps({"op": "subscribe", "args": [stream]}))
         except Exception as e:
-            self.logger.error(f"Failed to connect to Bybit WebSocket: {e}")
+            _log.error("Error sending %s subscription: %s", exchange, e)
+    
+    async def _run_connection(self, exchange: str, url: str, name: str,
+                              on_open: Callable, handler: Callable):
+        """Поддержание соединения с переподключением и экспоненциальной задержкой"""
+        delay = RECONNECT_DELAY_MIN
+        
+        while self.running:
+            try:
+                async with websockets.connect(url, **WS_CONNECT_OPTIONS) as websocket:
+                    self._tune_socket(websocket)
+                    self.connections[exchange] = websocket
+                    await on_open(websocket)
+                    delay = RECONNECT_DELAY_MIN
+                    await self._read_messages(websocket, name, handler)
+            except Exception as e:
+                _log.error("%s WebSocket connection error: %s", name, e)
+            finally:
+                self.connections.pop(exchange, None)
+            
+            if self.running:
+                _log.info("Reconnecting to %s WebSocket in %ss", name, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+    
+    def _tune_socket(self, websocket):
+        """TCP_NODELAY по флагу tcp_nodelay и увеличение буфера приема сокета
+
+        asyncio сам включает TCP_NODELAY на каждом TCP-транспорте, поэтому
+        значение флага записывается всегда: иначе False ничего не меняет.
+        """
+        sock = websocket.transport.get_extra_info('socket')
+        if sock is None:
+            return
+        
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+        except OSError as e:
+            _log.warning("Failed to tune WebSocket socket: %s", e)
+    
+    async def _read_messages(self, websocket, name: str, handler: Callable):
+        """Чтение и обработка сообщений соединения в двух отдельных задачах
+
+        Читатель только принимает кадры и разбирает JSON, чтобы буфер сокета
+        опустошался как можно быстрее; обработка идет в отдельной задаче.
+        """
+        rx = asyncio.Queue(maxsize=RX_QUEUE_SIZE)
+        reader = asyncio.create_task(self._receive_messages(websocket, rx, name))
+        processor = asyncio.create_task(self._process_messages(rx, name, handler))
+        
+        # Падение любой из задач завершает чтение, и _run_connection
+        # переподключается, а не копит сообщения в очереди без обработчика
+        try:
+            done, _ = await asyncio.wait({reader, processor},
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            reader.cancel()
+            processor.cancel()
+            await asyncio.gather(reader, processor, return_exceptions=True)
+        
+        for task in done:
+            task.result()
+        if processor in done and self.running:
+            raise RuntimeError(f"{name} message processor stopped")
+    
+    async def _receive_messages(self, websocket, rx: asyncio.Queue, name: str):
+        """Прием кадров соединения и разбор JSON в очередь обработки"""
+        while self.running:
+            message = await websocket.recv()
+            try:
+                rx.put_nowait(orjson.loads(message))
+            except asyncio.QueueFull:
+                _log.warning("%s receive queue is full, message dropped", name)
+    
+    async def _process_messages(self, rx: asyncio.Queue, name: str, handler: Callable):
+        """Обработка сообщений из очереди соединения"""
+        while self.running:
+            data = await rx.get()
+            try:
+                await handler(data)
+            except Exception as e:
+                # Ошибка в одном сообщении не должна останавливать обработку
+                _log.error("Error handling %s message: %s", name, e)
+    
+    async def _handle_binance_message(self, message: Dict):
+        """Маршрутизация сообщения Binance по типу события
+
+        Комбинированный поток оборачивает событие в {"stream", "data"};
+        ответы на SUBSCRIBE ({"result", "id"}) события не содержат.
+        """
+        data = message.get('data', message)
+        if not isinstance(data, dict):
+            return
+        handler = self._binance_handlers.get(data.get('e'))  # Тип события
+        if handler is not None:
+            await handler(data)
+            return
+        
+        # Частичный стакан (symbol@depth20@100ms) приходит без типа события
+        # и символа: символ берется из имени потока
+        stream = message.get('stream')
+        if stream is not None and '@depth' in stream:
+            await self._process_orderbook({
+                's': stream.partition('@')[0],
+                'u': data['lastUpdateId'],
+                'b': data['bids'],
+                'a': data['asks']
+            })
+    
+    async def _handle_bybit_message(self, data: Dict):
+        """Маршрутизация сообщения Bybit по топику"""
+        handler = self._bybit_handlers.get(data.get('topic', '').partition('.')[0])
+        if handler is not None:
+            await handler(data)
     
     async def _process_kline(self, data: Dict):
         """Обработка свечных данных"""
         try:
-            symbol = data['s'].lower()
+            kline = data['k']
             candle = {
-                'timestamp': datetime.fromtimestamp(data['k']['t'] / 1000),
-                'open': float(data['k']['o']),
-                'high': float(data['k']['h']),
-                'low': float(data['k']['l']),
-                'close': float(data['k']['c']),
-                'volume': float(data['k']['v']),
-                'is_closed': data['k']['x'],
-                'interval': data['k']['i']
+                # Время открытия в мс: datetime создается только при отображении
+                'timestamp_ms': kline['t'],
+                'open': float(kline['o']),
+                'high': float(kline['h']),
+                'low': float(kline['l']),
+                'close': float(kline['c']),
+                'volume': float(kline['v']),
+                'is_closed': kline['x'],
+                'interval': kline['i']
             }
             
             # Сохраняем в кеш
-            cache_key = f"{symbol}_{data['k']['i']}"
+            cache_key = _kline_key('binance', data['s'], kline['i'])
             if cache_key not in self.data_cache:
-                self.data_cache[cache_key] = []
+                self.data_cache[cache_key] = deque(maxlen=KLINE_HISTORY)
             
             candles = self.data_cache[cache_key]
             
             if candle['is_closed']:
-                # Добавляем новую свечу
+                # Добавляем новую свечу (deque сам вытесняет самую старую)
                 candles.append(candle)
-                # Ограничиваем количество свечей
-                if len(candles) > 1000:
-                    candles.pop(0)
             else:
                 # Обновляем текущую свечу
                 if candles and not candles[-1]['is_closed']:
                     candles[-1] = candle
                 else:
                     candles.append(candle)
+            self.versions[cache_key] += 1
             
             # Вызываем колбэки
-            if cache_key in self.callbacks:
-                for callback in self.callbacks[cache_key]:
-                    try:
-                        await callback(candle)
-                    except Exception as e:
-                        self.logger.error(f"Callback error: {e}")
+            self._dispatch(cache_key, candle)
             
         except Exception as e:
-            self.logger.error(f"Error processing kline: {e}")
+            _log.error("Error processing kline: %s", e)
     
     async def _process_trade(self, data: Dict):
         """Обработка данных о торгах"""
@@ -181,69 +436,63 @@ class MarketStreamer:
                 'symbol': data['s'],
                 'price': float(data['p']),
                 'quantity': float(data['q']),
-                'timestamp': datetime.fromtimestamp(data['T'] / 1000),
-                'is_buyer_maker': data['m']
+                'timestamp_ms': data['T'],
+                'is_buyer_maker': data['m'],
+                # Готовая строка времени (UTC, как ось графика): сделка
+                # неизменна, форматируем один раз
+                'time_str': datetime.fromtimestamp(
+                    data['T'] / 1000, tz=timezone.utc
+                ).strftime('%H:%M:%S')
             }
             
-            cache_key = f"trades_{data['s'].lower()}"
+            cache_key = _stream_key('binance', 'trades', data['s'])
             if cache_key not in self.data_cache:
-                self.data_cache[cache_key] = []
+                self.data_cache[cache_key] = TradeBuffer()
             
-            trades = self.data_cache[cache_key]
-            trades.append(trade)
+            self.data_cache[cache_key].append(trade)
+            self.versions[cache_key] += 1
             
-            if len(trades) > 100:
-                trades.pop(0)
+            self._dispatch(cache_key, trade)
             
             # Вызываем колбэки для тикеров
-            ticker_key = f"ticker_{data['s'].lower()}"
-            if ticker_key in self.callbacks:
-                for callback in self.callbacks[ticker_key]:
-                    try:
-                        await callback({
-                            'symbol': data['s'],
-                            'last_price': float(data['p']),
-                            'volume': float(data['q']),
-                            'timestamp': datetime.now()
-                        })
-                    except Exception as e:
-                        self.logger.error(f"Ticker callback error: {e}")
-                        
+            # Троттлинг под своим ключом: иначе частые сделки занимают окно
+            # и до подписчиков не доходят 24hrTicker с 24-часовыми полями
+            ticker_key = _stream_key('binance', 'ticker', data['s'])
+            if self._should_dispatch(ticker_key, TICKER_THROTTLE_NS,
+                                     _stream_key('binance', 'trade_ticker', data['s'])):
+                self._dispatch(ticker_key, {
+                    'symbol': data['s'],
+                    'last_price': float(data['p']),
+                    'volume': float(data['q']),
+                    'timestamp_ns': time_ns()
+                })
+
         except Exception as e:
-            self.logger.error(f"Error processing trade: {e}")
+            _log.error("Error processing trade: %s", e)
     
     async def _process_orderbook(self, data: Dict):
         """Обработка стакана ордеров"""
         try:
-            symbol = data['s'].lower()
-            cache_key = f"orderbook_{symbol}"
-            
-            # Инициализируем стакан если его нет
-            if cache_key not in self.data_cache:
-                self.data_cache[cache_key] = {
-                    'bids': [],
-                    'asks': [],
-                    'last_update_id': data['u']
-                }
-            
-            orderbook = self.data_cache[cache_key]
-            
-            # Обновляем стакан (упрощенно)
-            orderbook['bids'] = data.get('b', orderbook['bids'])
-            orderbook['asks'] = data.get('a', orderbook['asks'])
-            orderbook['last_update_id'] = data['u']
-            orderbook['timestamp'] = datetime.now()
+            cache_key = _stream_key('binance', 'orderbook', data['s'])
+            previous = self.data_cache.get(cache_key, _EMPTY_BOOK)
+            
+            # Каждое обновление публикуется новым словарем: отложенные через
+            # call_soon колбэки и очереди подписчиков держат неизменный снимок
+            orderbook = {
+                'bids': _parse_levels(data['b']) if 'b' in data else previous['bids'],
+                'asks': _parse_levels(data['a']) if 'a' in data else previous['asks'],
+                'last_update_id': data['u'],
+                'timestamp_ns': time_ns()
+            }
+            self.data_cache[cache_key] = orderbook
+            self.versions[cache_key] += 1
             
             # Вызываем колбэки
-            if cache_key in self.callbacks:
-                for callback in self.callbacks[cache_key]:
-                    try:
-                        await callback(orderbook)
-                    except Exception as e:
-                        self.logger.error(f"Orderbook callback error: {e}")
-                        
+            if self._should_dispatch(cache_key, ORDERBOOK_THROTTLE_NS):
+                self._dispatch(cache_key, orderbook)
+
         except Exception as e:
-            self.logger.error(f"Error processing orderbook: {e}")
+            _log.error("Error processing orderbook: %s", e)
     
     async def _process_ticker(self, data: Dict):
         """Обработка тикерных данных"""
@@ -256,33 +505,29 @@ class MarketStreamer:
                 'volume_24h': float(data['v']),
                 'price_change': float(data['p']),
                 'price_change_percent': float(data['P']),
-                'timestamp': datetime.now()
+                'timestamp_ns': time_ns()
             }
             
-            cache_key = f"ticker_{data['s'].lower()}"
+            cache_key = _stream_key('binance', 'ticker', data['s'])
             self.data_cache[cache_key] = ticker
+            self.versions[cache_key] += 1
             
             # Вызываем колбэки
-            if cache_key in self.callbacks:
-                for callback in self.callbacks[cache_key]:
-                    try:
-                        await callback(ticker)
-                    except Exception as e:
-                        self.logger.error(f"Ticker callback error: {e}")
-                        
+            if self._should_dispatch(cache_key, TICKER_THROTTLE_NS):
+                self._dispatch(cache_key, ticker)
+
         except Exception as e:
-            self.logger.error(f"Error processing ticker: {e}")
+            _log.error("Error processing ticker: %s", e)
     
     async def _process_bybit_kline(self, data: Dict):
         """Обработка свечных данных Bybit"""
         try:
-            topic = data['topic']
-            symbol = topic.split('.')[-1]
-            interval = topic.split('.')[2]
-            
+            # Топик Bybit: kline.{interval}.{symbol}, разбираем за один проход
+            _, interval, symbol = data['topic'].split('.', 2)
+
             candle_data = data['data'][0]
             candle = {
-                'timestamp': datetime.fromtimestamp(int(candle_data['start']) / 1000),
+                'timestamp_ms': int(candle_data['start']),
                 'open': float(candle_data['open']),
                 'high': float(candle_data['high']),
                 'low': float(candle_data['low']),
@@ -292,31 +537,25 @@ class MarketStreamer:
                 'is_closed': candle_data['confirm']
             }
             
-            cache_key = f"{symbol}_{interval}"
+            cache_key = _kline_key('bybit', symbol, interval)
             if cache_key not in self.data_cache:
-                self.data_cache[cache_key] = []
+                self.data_cache[cache_key] = deque(maxlen=KLINE_HISTORY)
             
             candles = self.data_cache[cache_key]
             
             if candle['is_closed']:
                 candles.append(candle)
-                if len(candles) > 1000:
-                    candles.pop(0)
             else:
                 if candles and not candles[-1]['is_closed']:
                     candles[-1] = candle
                 else:
                     candles.append(candle)
+            self.versions[cache_key] += 1
             
-            if cache_key in self.callbacks:
-                for callback in self.callbacks[cache_key]:
-                    try:
-                        await callback(candle)
-                    except Exception as e:
-                        self.logger.error(f"Bybit callback error: {e}")
-                        
+            self._dispatch(cache_key, candle)
+
         except Exception as e:
-            self.logger.error(f"Error processing Bybit kline: {e}")
+            _log.error("Error processing Bybit kline: %s", e)
     
     async def _process_bybit_ticker(self, data: Dict):
         """Обработка тикерных данных Bybit"""
@@ -328,41 +567,172 @@ class MarketStreamer:
                 'high_24h': float(ticker_data['highPrice24h']),
                 'low_24h': float(ticker_data['lowPrice24h']),
                 'volume_24h': float(ticker_data['volume24h']),
+                # price24hPcnt - доля, а не проценты
                 'price_change': float(ticker_data['price24hPcnt']),
-                'timestamp': datetime.now()
+                'price_change_percent': float(ticker_data['price24hPcnt']) * 100,
+                'timestamp_ns': time_ns()
             }
             
-            cache_key = f"ticker_{ticker_data['symbol'].lower()}"
+            cache_key = _stream_key('bybit', 'ticker', ticker_data['symbol'])
             self.data_cache[cache_key] = ticker
+            self.versions[cache_key] += 1
             
-            if cache_key in self.callbacks:
-                for callback in self.callbacks[cache_key]:
-                    try:
-                        await callback(ticker)
-                    except Exception as e:
-                        self.logger.error(f"Bybit ticker callback error: {e}")
-                        
+            if self._should_dispatch(cache_key, TICKER_THROTTLE_NS):
+                self._dispatch(cache_key, ticker)
+
         except Exception as e:
-            self.logger.error(f"Error processing Bybit ticker: {e}")
+            _log.error("Error processing Bybit ticker: %s", e)
     
-    def subscribe(self, exchange: str, symbol: str, stream_type: str, callback: Callable):
-        """Подписка на поток данных"""
+    def _should_dispatch(self, key: str, interval_ns: int,
+                         throttle_key: Optional[str] = None) -> bool:
+        """Проверка подписчиков и троттлинг по переднему фронту для ключа
+
+        throttle_key задает отдельное окно троттлинга для источника, который
+        публикует данные под тем же ключом (тикер из сделок).
+        """
+        route_id = self._route_ids.get(key)
+        if route_id is None or not self._routes[route_id]:
+            return False
+        
+        if throttle_key is None:
+            throttle_key = key
+        now = time_ns()
+        if now - self._throttle_ns.get(throttle_key, 0) < interval_ns:
+            return False
+        
+        self._throttle_ns[throttle_key] = now
+        return True
+
+    def _dispatch(self, key: str, payload: Any):
+        """Рассылка данных подписчикам без блокировки чтения из сокета
+
+        Синхронные колбэки планируются через loop.call_soon, асинхронные
+        получают данные через очередь, которую разбирает одна задача на ключ,
+        пакетные - список сообщений, накопленных за BATCH_WINDOW.
+        """
+        route_id = self._route_ids.get(key)
+        if route_id is None:
+            return
+        routes = self._routes[route_id]
+        if not routes:
+            return
+
+        has_async = has_batch = False
+        for callback, mode in routes:
+            if mode == _CB_SYNC:
+                self.event_loop.call_soon(self._run_callback, key, callback, payload)
+            elif mode == _CB_ASYNC:
+                has_async = True
+            else:
+                has_batch = True
+
+        if has_async:
+            queue = self._cb_queues.get(key)
+            if queue is None:
+                queue = self._cb_queues[key] = asyncio.Queue()
+                self._cb_workers[key] = self.event_loop.create_task(
+                    self._drain_callbacks(key, route_id, queue)
+                )
+            queue.put_nowait(payload)
+
+        if has_batch:
+            batch = self._batches.get(key)
+            if batch is None:
+                self._batches[key] = [payload]
+                self.event_loop.call_later(BATCH_WINDOW, self._flush_batch, key, route_id)
+            else:
+                batch.append(payload)
+
+    def _flush_batch(self, key: str, route_id: int):
+        """Передача накопленной пачки сообщений пакетным колбэкам"""
+        batch = self._batches.pop(key)
+        for callback, mode in self._routes[route_id]:
+            if mode == _CB_BATCH:
+                self._run_callback(key, callback, batch)
+
+    def _run_callback(self, key: str, callback: Callable, payload: Any):
+        """Вызов синхронного колбэка"""
+        try:
+            callback(payload)
+        except Exception as e:
+            _log.error("Callback error for %s: %s", key, e)
+
+    async def _drain_callbacks(self, key: str, route_id: int, queue: asyncio.Queue):
+        """Обработчик очереди асинхронных колбэков для одного ключа"""
+        while True:
+            payload = await queue.get()
+            for callback, mode in self._routes[route_id]:
+                if mode != _CB_ASYNC:
+                    continue
+                try:
+                    await callback(payload)
+                except Exception as e:
+                    _log.error("Callback error for %s: %s", key, e)
+
+    def _update_stats(self):
+        """Обновление снимков подписок после subscribe/unsubscribe"""
+        self.active_streams = tuple(self.callbacks)
+        self.sub_count = len(self.active_streams)
+
+    def _rebuild_route(self, route_key: str):
+        """Пересборка снимка колбэков маршрута после изменения подписок
+
+        Снимок - неизменяемый кортеж, который целиком заменяется, поэтому
+        поток event loop читает его без блокировок (copy-on-write).
+        """
+        routes = tuple(
+            item
+            for stream_key, callbacks in self.callbacks.items()
+            if self._stream_routes[stream_key] == route_key
+            for item in callbacks.items()
+        )
+        
+        route_id = self._route_ids.get(route_key)
+        if route_id is None:
+            self._routes.append(routes)
+            self._route_ids[route_key] = len(self._routes) - 1
+        else:
+            self._routes[route_id] = routes
+
+    def subscribe(self, exchange: str, symbol: str, stream_type: str, callback: Callable,
+                  batch: bool = False):
+        """Подписка на поток данных
+
+        При batch=True синхронный колбэк вызывается со списком сообщений,
+        накопленных за BATCH_WINDOW, вместо вызова на каждое сообщение.
+        """
         try:
             stream_key = f"{exchange}_{symbol}_{stream_type}"
             
             if stream_key not in self.callbacks:
-                self.callbacks[stream_key] = []
+                self.callbacks[stream_key] = {}
+                self._stream_routes[stream_key] = _route_key(exchange, symbol, stream_type)
             
-            self.callbacks[stream_key].append(callback)
+            if batch:
+                mode = _CB_BATCH
+            elif asyncio.iscoroutinefunction(callback):
+                mode = _CB_ASYNC
+            else:
+                mode = _CB_SYNC
+            self.callbacks[stream_key][callback] = mode
+            self._rebuild_route(self._stream_routes[stream_key])
+            self._update_stats()
+            
+            # Новый поток досылаем подпиской в уже открытое соединение биржи
+            stream = _exchange_stream(exchange, symbol, stream_type)
+            if stream is not None and self._add_streams(exchange, [stream]) and self.event_loop:
+                asyncio.run_coroutine_threadsafe(
+                    self._send_subscribe(exchange, [stream]), self.event_loop
+                )
             
             # Запускаем соединение если еще не запущено
             if not self.running:
                 self.start()
             
-            self.logger.info(f"Subscribed to {stream_key}")
+            _log.info("Subscribed to %s", stream_key)
             
         except Exception as e:
-            self.logger.error(f"Error subscribing to stream: {e}")
+            _log.error("Error subscribing to stream: %s", e)
     
     def unsubscribe(self, exchange: str, symbol: str, stream_type: str, callback: Callable):
         """Отписка от потока данных"""
@@ -370,34 +740,53 @@ class MarketStreamer:
             stream_key = f"{exchange}_{symbol}_{stream_type}"
             
             if stream_key in self.callbacks:
-                if callback in self.callbacks[stream_key]:
-                    self.callbacks[stream_key].remove(callback)
+                self.callbacks[stream_key].pop(callback, None)
+                route_key = self._stream_routes[stream_key]
                     
                 if not self.callbacks[stream_key]:
                     del self.callbacks[stream_key]
+                    del self._stream_routes[stream_key]
+                
+                self._rebuild_route(route_key)
+                self._update_stats()
             
-            self.logger.info(f"Unsubscribed from {stream_key}")
+            _log.info("Unsubscribed from %s", stream_key)
             
         except Exception as e:
-            self.logger.error(f"Error unsubscribing from stream: {e}")
+            _log.error("Error unsubscribing from stream: %s", e)
+    
+    def is_subscribed(self, exchange: str, symbol: str, stream_type: str,
+                      callback: Optional[Callable] = None) -> bool:
+        """Проверка наличия подписки на поток (и конкретного колбэка, если указан)"""
+        callbacks = self.callbacks.get(f"{exchange}_{symbol}_{stream_type}")
+        if not callbacks:
+            return False
+        return callback is None or callback in callbacks
+    
+    @staticmethod
+    def cache_key(exchange: str, symbol: str, stream_type: str) -> str:
+        """Ключ data_cache и versions для потока подписки (binance_trades_btcusdt)"""
+        return _route_key(exchange, symbol, stream_type)
     
     def get_latest_data(self, exchange: str, symbol: str, stream_type: str, limit: int = 100):
         """Получение последних данных из кеша"""
         try:
-            cache_key = f"{exchange}_{symbol}_{stream_type}"
+            cache_key = self.cache_key(exchange, symbol, stream_type)
             
             if cache_key in self.data_cache:
                 data = self.data_cache[cache_key]
                 
-                if isinstance(data, list):
-                    return data[-limit:] if len(data) > limit else data
+                if isinstance(data, deque):
+                    return list(islice(data, max(len(data) - limit, 0), None))
+                elif isinstance(data, TradeBuffer):
+                    return data.records(limit)
                 else:
                     return data
             
             return None
             
         except Exception as e:
-            self.logger.error(f"Error getting latest data: {e}")
+            _log.error("Error getting latest data: %s", e)
             return None
     
     def start(self):
@@ -406,25 +795,63 @@ class MarketStreamer:
             self.running = True
             self.thread = threading.Thread(target=self._run_event_loop, daemon=True)
             self.thread.start()
-            self.logger.info("WebSocket client started")
+            _log.info("WebSocket client started")
     
     def stop(self):
         """Остановка WebSocket клиента"""
         if self.running:
             self.running = False
             
-            if self.event_loop and self.event_loop.is_running():
-                self.event_loop.call_soon_threadsafe(self.event_loop.stop)
+            # Единственный сигнал между потоками: соединения завершаются
+            # внутри event loop через отмену задач
+            if self.event_loop and self._stop_event and self.event_loop.is_running():
+                self.event_loop.call_soon_threadsafe(self._stop_event.set)
             
             if self.thread:
                 self.thread.join(timeout=5)
             
-            self.logger.info("WebSocket client stopped")
+            _log.info("WebSocket client stopped")
     
     def _run_event_loop(self):
         """Запуск асинхронного event loop в отдельном потоке"""
-        self.event_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.event_loop)
+        self._pin_thread()
+        
+        try:
+            asyncio.run(self._run_connections())
+        except Exception as e:
+            _log.error("Event loop error: %s", e)
+        finally:
+            self.event_loop = None
+            self._stop_event = None
+            self._reset_dispatch_state()
+    
+    def _reset_dispatch_state(self):
+        """Сброс очередей, воркеров, пачек и троттлинга, привязанных к event loop"""
+        # Воркеры и отложенные сбросы пачек умирают вместе с loop; без сброса
+        # после stop()/start() async-подписчики и пачки больше не вызываются
+        self._cb_queues.clear()
+        self._cb_workers.clear()
+        self._batches.clear()
+        self._throttle_ns.clear()
+    
+    def _pin_thread(self):
+        """Привязка потока event loop к ядру из MARKET_STREAMER_CPU (если задано)"""
+        cpu = os.environ.get('MARKET_STREAMER_CPU')
+        if cpu is None or not hasattr(os, 'sched_setaffinity'):
+            return
+        
+        try:
+            # pid 0 - текущий поток
+            os.sched_setaffinity(0, {int(cpu)})
+            _log.info("Event loop thread pinned to CPU %s", cpu)
+        except (ValueError, OSError) as e:
+            _log.warning("Failed to pin event loop thread to CPU %s: %s", cpu, e)
+    
+    async def _run_connections(self):
+        """Запуск подключений к биржам до их завершения или вызова stop()"""
+        self.event_loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._reset_dispatch_state()
         
         # Запускаем подключения к биржам
         tasks = []
@@ -438,15 +865,24 @@ class MarketStreamer:
             "ethusdt@trade"
         ]
         
-        tasks.append(self.event_loop.create_task(self.connect_binance_ws(binance_streams)))
+        tasks.append(asyncio.create_task(self.connect_binance_ws(binance_streams)))
         
-        # Запускаем все задачи
-        try:
-            self.event_loop.run_until_complete(asyncio.gather(*tasks))
-        except Exception as e:
-            self.logger.error(f"Event loop error: {e}")
-        finally:
-            self.event_loop.close()
+        # Подключение к Bybit в том же event loop
+        bybit_streams = [
+            "kline.1.BTCUSDT",
+            "tickers.BTCUSDT"
+        ]
+        
+        tasks.append(asyncio.create_task(self.connect_bybit_ws(bybit_streams)))
+        
+        # Ждем завершения всех подключений или сигнала остановки
+        connections = asyncio.gather(*tasks)
+        stop_waiter = asyncio.create_task(self._stop_event.wait())
+        await asyncio.wait([connections, stop_waiter], return_when=asyncio.FIRST_COMPLETED)
+        
+        connections.cancel()
+        stop_waiter.cancel()
+        await asyncio.gather(connections, stop_waiter, return_exceptions=True)
 
 
 # Синглтон для глобального доступа
@@ -463,7 +899,7 @@ if __name__ == "__main__":
     import time
     
     def print_candle(candle):
-        print(f"New candle: {candle['close']} at {candle['timestamp']}")
+        print(f"New candle: {candle['close']} at {datetime.fromtimestamp(candle['timestamp_ms'] / 1000)}")
     
     def print_trade(trade):
         print(f"Trade: {trade['symbol']} {trade['price']} x {trade['quantity']}")
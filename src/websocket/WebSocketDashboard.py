@@ -3,13 +3,201 @@ WebSocketDashboard.py - Веб-компоненты для отображени
 """
 
 import streamlit as st
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import pandas as pd
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-import json
-from ..websocket.MarketStreamer import get_market_streamer
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional
+import orjson
+from collections import deque
+from itertools import islice
+import numpy as np
+from ..websocket.MarketStreamer import TradeBuffer, get_market_streamer
+
+# plotly и pandas импортируются в функциях отрисовки: импорт модуля
+# (тесты, CLI) не тянет за собой тяжелые зависимости
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Период автообновления панелей: каждая панель - отдельный st.fragment,
+# поэтому перерисовывается только она, а не весь скрипт
+REFRESH_INTERVAL = "1s"
+
+# Количество свечей, хранимых для графика каждого символа
+CANDLE_HISTORY = 100
+
+# Форматтеры значений тикеров: связанный str.format собирается один раз
+_PRICE_FMT = '${:,.2f}'.format
+_PCT_FMT = '{} {:.2f}%'.format
+_VOLUME_FMT = '24h Vol: ${:,.0f}'.format
+
+# Форматирование колонок таблиц выполняется на стороне браузера
+_PRICE_COLUMN = st.column_config.NumberColumn('Цена', format='$%.2f')
+_VOLUME_COLUMN = st.column_config.NumberColumn('Объем', format='%.4f')
+
+ORDER_BOOK_COLUMNS = {
+    'Цена': _PRICE_COLUMN,
+    'Объем': _VOLUME_COLUMN,
+    'Суммарный объем': st.column_config.NumberColumn('Суммарный объем', format='%.4f'),
+}
+
+TRADE_COLUMNS = {
+    'Цена': _PRICE_COLUMN,
+    'Объем': _VOLUME_COLUMN,
+}
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _candlestick_layout(symbol: str, title: Optional[str]) -> dict:
+    """Макет свечного графика: зависит только от символа и заголовка"""
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    
+    fig.update_layout(
+        title=title or f"{symbol.upper()} - Real-time",
+        # Масштаб и прокрутка пользователя сохраняются между обновлениями
+        uirevision=symbol,
+        yaxis_title="Price (USD)",
+        xaxis_title="Time",
+        template="plotly_dark",
+        height=500,
+        showlegend=True
+    )
+    
+    # Обновляем макет для лучшего отображения времени
+    fig.update_xaxes(
+        rangeslider_visible=False,
+        rangeselector=dict(
+            buttons=list([
+                dict(count=15, label="15m", step="minute", stepmode="backward"),
+                dict(count=1, label="1h", step="hour", stepmode="backward"),
+                dict(count=6, label="6h", step="hour", stepmode="backward"),
+                dict(count=1, label="1d", step="day", stepmode="backward"),
+                dict(step="all")
+            ])
+        )
+    )
+    
+    return fig.to_dict()['layout']
+
+
+def _build_candlestick_figure(symbol: str, title: Optional[str], candles: "CandleBuffer"):
+    """Свечной график по всем свечам буфера, включая текущую незакрытую
+
+    Данные трассы передаются numpy-колонками напрямую: сериализованный
+    словарь фигуры хранит массивы в бинарном виде ({'dtype', 'bdata'})
+    и не годится для дописывания свечей.
+    """
+    import plotly.graph_objects as go
+    
+    ts, opens, highs, lows, closes = candles.columns()
+    
+    return go.Figure(
+        data=[
+            go.Candlestick(
+                x=ts.astype('datetime64[ms]'),
+                open=opens,
+                high=highs,
+                low=lows,
+                close=closes,
+                name=symbol.upper()
+            )
+        ],
+        layout=_candlestick_layout(symbol, title)
+    )
+
+
+def _book_frame(levels: np.ndarray) -> "pd.DataFrame":
+    """Таблица одной стороны стакана с накопленным объемом"""
+    import pandas as pd
+    
+    return pd.DataFrame({
+        'Цена': levels[:, 0],
+        'Объем': levels[:, 1],
+        'Суммарный объем': np.cumsum(levels[:, 1])
+    })
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _order_book_frames(cache_key: str, version: int, depth: int, _orderbook: Dict):
+    """Таблицы bids/asks для версии стакана: пока streamer не обновил стакан,
+    все сессии получают уже собранные таблицы"""
+    # Уровни стакана в streamer уже лежат в numpy-массивах (цена, объем)
+    bids = np.asarray(_orderbook.get('bids', ())[:depth], dtype=np.float64).reshape(-1, 2)
+    asks = np.asarray(_orderbook.get('asks', ())[:depth], dtype=np.float64).reshape(-1, 2)
+    return _book_frame(bids), _book_frame(asks)
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _trade_frame(cache_key: str, version: int, limit: int,
+                 _trades: TradeBuffer) -> "pd.DataFrame":
+    """Таблица последних сделок для версии кеша сделок"""
+    import pandas as pd
+    
+    # Сделки лежат в streamer по колонкам, время форматируется при получении,
+    # направление выбирается одной векторной операцией по флагу мейкера
+    recent = _trades.tail(limit)
+    return pd.DataFrame({
+        'Время': recent['time_str'],
+        'Цена': recent['price'],
+        'Объем': recent['quantity'],
+        'Тип': np.where(recent['is_buyer_maker'], '🔴 Продажа', '🟢 Покупка')
+    })
+
+
+class CandleBuffer:
+    """Кольцевой буфер свечей в виде параллельных numpy-массивов (timestamp/OHLC)"""
+    
+    def __init__(self, size: int = CANDLE_HISTORY):
+        self.size = size
+        self.ts = np.zeros(size, dtype=np.int64)
+        self.open = np.zeros(size, dtype=np.float64)
+        self.high = np.zeros(size, dtype=np.float64)
+        self.low = np.zeros(size, dtype=np.float64)
+        self.close = np.zeros(size, dtype=np.float64)
+        self.head = 0  # Сколько свечей записано всего
+    
+    def __len__(self) -> int:
+        return min(self.head, self.size)
+    
+    def update(self, candle: Dict):
+        """Запись свечи: обновление текущей или добавление новой"""
+        last = (self.head - 1) % self.size
+        append = not (self.head and self.ts[last] == candle['timestamp_ms'])
+        i = self.head % self.size if append else last
+        
+        self.ts[i] = candle['timestamp_ms']
+        self.open[i] = candle['open']
+        self.high[i] = candle['high']
+        self.low[i] = candle['low']
+        self.close[i] = candle['close']
+        # head сдвигается после записи: поток Streamlit читает columns()
+        # параллельно и не должен увидеть еще не заполненный слот
+        if append:
+            self.head += 1
+    
+    def update_batch(self, candles: List[Dict]):
+        """Запись пачки свечей: из подряд идущих обновлений одной свечи
+        применяется только последнее"""
+        last = len(candles) - 1
+        for i, candle in enumerate(candles):
+            if i < last and candles[i + 1]['timestamp_ms'] == candle['timestamp_ms']:
+                continue
+            self.update(candle)
+    
+    def columns(self):
+        """Колонки (ts, open, high, low, close) в хронологическом порядке"""
+        # head читается один раз: запись идет из потока streamer, и все
+        # колонки должны получиться одной длины
+        head = self.head
+        arrays = (self.ts, self.open, self.high, self.low, self.close)
+        if head <= self.size:
+            return tuple(a[:head] for a in arrays)
+        start = head % self.size
+        return tuple(np.concatenate((a[start:], a[:start])) for a in arrays)
+
+
+# Буферы свечей на процесс: подписка на символ регистрируется один раз
+_candle_buffers: Dict[str, CandleBuffer] = {}
 
 
 class WebSocketDashboard:
@@ -17,88 +205,36 @@ class WebSocketDashboard:
     
     def __init__(self):
         self.streamer = get_market_streamer()
+        # Кольцевые буферы свечей по символам, общие для всех сессий
+        # и для всех экземпляров дашборда (в том числе после сброса кеша)
+        self.candles = _candle_buffers
         self._setup_callbacks()
     
     def _setup_callbacks(self):
         """Настройка callback функций для обновления данных"""
         
-        # Callback для обновления свечных данных в сессии Streamlit
-        def update_candle_data(candle):
-            cache_key = f"candle_{candle.get('symbol', 'btcusdt')}"
-            
-            if cache_key not in st.session_state:
-                st.session_state[cache_key] = []
-            
-            candles = st.session_state[cache_key]
-            
-            if candle['is_closed']:
-                candles.append(candle)
-                if len(candles) > 100:
-                    candles.pop(0)
-            else:
-                if candles and not candles[-1]['is_closed']:
-                    candles[-1] = candle
-                else:
-                    candles.append(candle)
-        
-        # Подписываемся на данные
-        self.streamer.subscribe("binance", "btcusdt", "kline_1m", update_candle_data)
-        self.streamer.subscribe("binance", "ethusdt", "kline_1m", update_candle_data)
+        # Подписываемся на свечные данные пачками: буфер символа сам обновляет
+        # текущую свечу или добавляет новую
+        for symbol in ("btcusdt", "ethusdt"):
+            candles = self.candles.setdefault(symbol, CandleBuffer())
+            if not self.streamer.is_subscribed("binance", symbol, "kline_1m", candles.update_batch):
+                self.streamer.subscribe("binance", symbol, "kline_1m", candles.update_batch, batch=True)
     
+    @st.fragment(run_every=REFRESH_INTERVAL)
     def display_real_time_chart(self, symbol: str = "btcusdt", title: str = None):
         """Отображение реального графика цен"""
-        
-        cache_key = f"candle_{symbol}"
-        
-        if cache_key not in st.session_state:
-            st.session_state[cache_key] = []
-        
-        candles = st.session_state[cache_key]
+        candles = self.candles.get(symbol)
         
         if not candles:
             st.info(f"Ожидание данных для {symbol}...")
             return
         
-        # Создаем DataFrame из свечей
-        df = pd.DataFrame(candles)
+        fig = _build_candlestick_figure(symbol, title, candles)
         
-        # Создаем график
-        fig = go.Figure(data=[
-            go.Candlestick(
-                x=df['timestamp'],
-                open=df['open'],
-                high=df['high'],
-                low=df['low'],
-                close=df['close'],
-                name=symbol.upper()
-            )
-        ])
-        
-        fig.update_layout(
-            title=title or f"{symbol.upper()} - Real-time",
-            yaxis_title="Price (USD)",
-            xaxis_title="Time",
-            template="plotly_dark",
-            height=500,
-            showlegend=True
-        )
-        
-        # Обновляем макет для лучшего отображения времени
-        fig.update_xaxes(
-            rangeslider_visible=False,
-            rangeselector=dict(
-                buttons=list([
-                    dict(count=15, label="15m", step="minute", stepmode="backward"),
-                    dict(count=1, label="1h", step="hour", stepmode="backward"),
-                    dict(count=6, label="6h", step="hour", stepmode="backward"),
-                    dict(count=1, label="1d", step="day", stepmode="backward"),
-                    dict(step="all")
-                ])
-            )
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
+        # Стабильный key: браузер обновляет существующий график, а не создает новый
+        st.plotly_chart(fig, use_container_width=True, key=f"chart_{symbol}")
     
+    @st.fragment(run_every=REFRESH_INTERVAL)
     def display_ticker_panel(self, symbols: List[str] = None):
         """Панель с тикерами в реальном времени"""
         
@@ -111,34 +247,30 @@ class WebSocketDashboard:
         cols = st.columns(len(symbols))
         
         for idx, symbol in enumerate(symbols):
-            cache_key = f"ticker_{symbol}"
+            cache_key = self.streamer.cache_key("binance", symbol, "ticker")
+            ticker = self.streamer.data_cache.get(cache_key)
             
-            if cache_key in self.streamer.data_cache:
-                ticker = self.streamer.data_cache[cache_key]
-                
+            if ticker is not None:
                 with cols[idx]:
-                    # Определяем цвет изменения цены
+                    # Определяем направление изменения цены
                     change_percent = ticker.get('price_change_percent', 0)
                     if change_percent > 0:
-                        color = "green"
                         arrow = "↑"
                     elif change_percent < 0:
-                        color = "red"
                         arrow = "↓"
                     else:
-                        color = "gray"
                         arrow = "→"
                     
                     # Отображаем тикер
                     st.metric(
                         label=symbol.upper(),
-                        value=f"${ticker.get('last_price', 0):,.2f}",
-                        delta=f"{arrow} {abs(change_percent):.2f}%",
+                        value=_PRICE_FMT(ticker.get('last_price', 0)),
+                        delta=_PCT_FMT(arrow, abs(change_percent)),
                         delta_color="normal" if change_percent >= 0 else "inverse"
                     )
                     
                     # Дополнительная информация
-                    st.caption(f"24h Vol: ${ticker.get('volume_24h', 0):,.0f}")
+                    st.caption(_VOLUME_FMT(ticker.get('volume_24h', 0)))
             else:
                 with cols[idx]:
                     st.metric(
@@ -147,30 +279,24 @@ class WebSocketDashboard:
                         delta="..."
                     )
     
+    @st.fragment(run_every=REFRESH_INTERVAL)
     def display_order_book(self, symbol: str = "btcusdt", depth: int = 10):
         """Отображение стакана ордеров"""
         
-        cache_key = f"orderbook_{symbol}"
+        cache_key = self.streamer.cache_key("binance", symbol, "depth20@100ms")
         
         if cache_key not in self.streamer.data_cache:
             st.info(f"Ожидание данных стакана для {symbol}...")
             return
         
+        # Версия читается до стакана: streamer сначала заменяет стакан, потом
+        # увеличивает версию, и старый стакан не попадет в кеш под новой версией
+        version = self.streamer.versions.get(cache_key, 0)
         orderbook = self.streamer.data_cache[cache_key]
         
         st.subheader(f"📖 Стакан ордеров - {symbol.upper()}")
         
-        # Создаем DataFrame для bids и asks
-        bids_df = pd.DataFrame(orderbook.get('bids', []), columns=['Цена', 'Объем'])
-        asks_df = pd.DataFrame(orderbook.get('asks', []), columns=['Цена', 'Объем'])
-        
-        # Ограничиваем глубину
-        bids_df = bids_df.head(depth)
-        asks_df = asks_df.head(depth)
-        
-        # Вычисляем суммарный объем
-        bids_df['Суммарный объем'] = bids_df['Объем'].cumsum()
-        asks_df['Суммарный объем'] = asks_df['Объем'].cumsum()
+        bids_df, asks_df = _order_book_frames(cache_key, version, depth, orderbook)
         
         # Отображаем две таблицы рядом
         col1, col2 = st.columns(2)
@@ -178,11 +304,8 @@ class WebSocketDashboard:
         with col1:
             st.markdown("**🟢 Покупки (Bids)**")
             st.dataframe(
-                bids_df.style.format({
-                    'Цена': '${:,.2f}',
-                    'Объем': '{:,.4f}',
-                    'Суммарный объем': '{:,.4f}'
-                }),
+                bids_df,
+                column_config=ORDER_BOOK_COLUMNS,
                 use_container_width=True,
                 height=400
             )
@@ -190,30 +313,28 @@ class WebSocketDashboard:
         with col2:
             st.markdown("**🔴 Продажи (Asks)**")
             st.dataframe(
-                asks_df.style.format({
-                    'Цена': '${:,.2f}',
-                    'Объем': '{:,.4f}',
-                    'Суммарный объем': '{:,.4f}'
-                }),
+                asks_df,
+                column_config=ORDER_BOOK_COLUMNS,
                 use_container_width=True,
                 height=400
             )
         
         # Отображаем спред
-        if not bids_df.empty and not asks_df.empty:
-            best_bid = bids_df['Цена'].iloc[0]
-            best_ask = asks_df['Цена'].iloc[0]
+        if len(bids_df) and len(asks_df):
+            best_bid = bids_df['Цена'].iat[0]
+            best_ask = asks_df['Цена'].iat[0]
             spread = best_ask - best_bid
             spread_percent = (spread / best_bid) * 100
             
             st.info(f"**Спред:** ${spread:.2f} ({spread_percent:.2f}%) | "
-                   f**Лучшая цена покупки:** ${best_bid:.2f} | "
-                   f**Лучшая цена продажи:** ${best_ask:.2f}")
+                    f"**Лучшая цена покупки:** ${best_bid:.2f} | "
+                    f"**Лучшая цена продажи:** ${best_ask:.2f}")
     
+    @st.fragment(run_every=REFRESH_INTERVAL)
     def display_trade_history(self, symbol: str = "btcusdt", limit: int = 20):
         """Отображение истории сделок"""
         
-        cache_key = f"trades_{symbol}"
+        cache_key = self.streamer.cache_key("binance", symbol, "trade")
         
         if cache_key not in self.streamer.data_cache:
             st.info(f"Ожидание данных сделок для {symbol}...")
@@ -224,51 +345,36 @@ class WebSocketDashboard:
         if not trades:
             return
         
-        # Берем последние сделки
-        recent_trades = trades[-limit:] if len(trades) > limit else trades
-        
         st.subheader(f"🔄 Последние сделки - {symbol.upper()}")
         
-        # Создаем DataFrame
-        trades_df = pd.DataFrame(recent_trades)
-        
-        # Форматируем время
-        if 'timestamp' in trades_df.columns:
-            trades_df['Время'] = pd.to_datetime(trades_df['timestamp']).dt.strftime('%H:%M:%S')
-        
-        # Определяем направление сделки
-        trades_df['Тип'] = trades_df['is_buyer_maker'].apply(
-            lambda x: '🟢 Покупка' if not x else '🔴 Продажа'
-        )
-        
-        # Отображаем таблицу
-        display_cols = ['Время', 'Цена', 'Объем', 'Тип']
+        # Пока сделок не прибавилось, берется уже собранная таблица
+        version = self.streamer.versions.get(cache_key, 0)
+        trades_df = _trade_frame(cache_key, version, limit, trades)
         
         st.dataframe(
-            trades_df[display_cols].rename(columns={
-                'Цена': 'Цена ($)',
-                'Объем': 'Объем'
-            }),
+            trades_df,
+            column_config=TRADE_COLUMNS,
             use_container_width=True,
             height=300
         )
     
+    @st.fragment(run_every=REFRESH_INTERVAL)
     def display_websocket_status(self):
         """Отображение статуса WebSocket соединений"""
         
         st.subheader("📡 Статус WebSocket соединений")
         
-        status_cols = st.columns(3)
+        status_cols = st.columns(2)
         
         with status_cols[0]:
             if self.streamer.running:
                 st.success("🟢 WebSocket активен")
-                st.caption(f"Подписок: {len(self.streamer.callbacks)}")
+                st.caption(f"Подписок: {self.streamer.sub_count}")
+                st.caption(f"TCP_NODELAY: {'вкл' if self.streamer.tcp_nodelay else 'выкл'}")
             else:
                 st.error("🔴 WebSocket неактивен")
                 if st.button("Запустить WebSocket"):
                     self.streamer.start()
-                    st.rerun()
         
         with status_cols[1]:
             if self.streamer.data_cache:
@@ -276,18 +382,20 @@ class WebSocketDashboard:
             else:
                 st.warning("📭 Нет данных")
         
-        with status_cols[2]:
-            # Кнопка обновления
-            if st.button("🔄 Обновить данные"):
-                st.rerun()
-        
         # Отображаем список активных потоков
-        if self.streamer.callbacks:
+        active_streams = self.streamer.active_streams
+        if active_streams:
             st.markdown("**Активные потоки:**")
-            for stream_key in self.streamer.callbacks.keys():
+            for stream_key in active_streams:
                 st.caption(f"• {stream_key}")
 
 
+@st.cache_resource
+def get_dashboard() -> WebSocketDashboard:
+    """Один дашборд на процесс: подписки регистрируются только при создании"""
+    return WebSocketDashboard()
+
+
 def main():
     """Основная функция для тестирования дашборда"""
     import streamlit as st
@@ -297,7 +405,7 @@ def main():
     st.title("🌐 WebSocket Dashboard - Real-time Market Data")
     
     # Инициализируем дашборд
-    dashboard = WebSocketDashboard()
+    dashboard = get_dashboard()
     
     # Запускаем WebSocket если еще не запущен
     if not dashboard.streamer.running:
@@ -356,15 +464,22 @@ def main():
                 # Преобразуем данные для экспорта
                 export_data = {}
                 for key, value in dashboard.streamer.data_cache.items():
-                    if isinstance(value, list):
-                        export_data[key] = value[-100:]  # Последние 100 записей
+                    if isinstance(value, deque):
+                        # Последние 100 записей без копирования всего буфера
+                        export_data[key] = list(islice(value, max(len(value) - 100, 0), None))
+                    elif isinstance(value, TradeBuffer):
+                        export_data[key] = value.records(100)
                     else:
                         export_data[key] = value
                 
                 # Создаем JSON для скачивания
                 st.download_button(
                     label="Скачать данные",
-                    data=json.dumps(export_data, default=str, indent=2),
+                    data=orjson.dumps(
+                        export_data,
+                        default=str,
+                        option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+                    ),
                     file_name=f"market_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                     mime="application/json"
                 )
@@ -0,0 +1,38 @@
+"""
+Shared pytest fixtures
+"""
+
+import httpx
+import pytest
+import pytest_asyncio
+
+# Import project modules once at collection time so tests resolve them
+# from sys.modules (src.web.api pulls in FastAPI/pydantic and is the slowest)
+import src.core
+import src.web.api
+import src.bots
+import src.data
+import src.execution
+import src.risk
+
+
+@pytest.fixture(scope="session")
+def platform():
+    """TradingPlatform instance created once per test session"""
+    from src.core import TradingPlatform
+    return TradingPlatform()
+
+
+@pytest.fixture(scope="session")
+def app_instance():
+    """FastAPI application imported once per test session"""
+    from src.web.api import app
+    return app
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def aclient(app_instance):
+    """Async HTTP client calling the app in-process through ASGITransport"""
+    transport = httpx.ASGITransport(app=app_instance)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
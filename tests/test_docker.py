@@ -57,10 +57,19 @@ def test_requirements_txt_exists():
     # Check for key dependencies
     assert "fastapi" in content
     assert "uvicorn" in content
-    assert "pytest" in content
     
     print("✓ requirements.txt is valid")
 
+def test_requirements_dev_txt_exists():
+    """Test that test tools are kept out of runtime requirements"""
+    with open("requirements-dev.txt", "r") as f:
+        content = f.read()
+    
+    assert "-r requirements.txt" in content
+    assert "pytest" in content
+    
+    print("✓ requirements-dev.txt is valid")
+
 def test_makefile_commands():
     """Test that Makefile has essential commands"""
     with open("Makefile", "r") as f:
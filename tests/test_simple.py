@@ -2,58 +2,56 @@
 Basic tests for all project modules
 """
 
-def test_core_module():
+import importlib
+import pytest
+
+# Bind the package classes at collection: tests/test_quick.py imports the
+# src.data.MarketData and src.execution.OrderExecutor submodules at run time,
+# which replaces the same-named classes on their packages
+from src.bots import BaseTradingBot
+from src.data import MarketData
+from src.execution import OrderExecutor
+from src.risk import RiskManager
+
+def test_core_module(platform):
     """Test core module import"""
-    try:
-        from src.core import TradingPlatform
-        platform = TradingPlatform()
-        assert platform.name == "Trading Platform"
-        print("✅ Core module: OK")
-        return True
-    except Exception as e:
-        print(f"❌ Core module error: {e}")
-        return False
-
-def test_web_module():
+    assert platform.name == "Trading Platform"
+
+def test_web_module(app_instance):
     """Test web module import"""
-    try:
-        from src.web.api import app
-        assert app is not None
-        print("✅ Web module: OK")
-        return True
-    except Exception as e:
-        print(f"❌ Web module error: {e}")
-        return False
-
-def test_import_all_modules():
-    """Test importing all main modules"""
-    modules_to_test = [
-        ("src.bots", "BaseTradingBot"),
-        ("src.data", "MarketData"),
-        ("src.execution", "OrderExecutor"),
-        ("src.risk", "RiskManager"),
-    ]
-    
-    all_passed = True
-    
-    for module, class_name in modules_to_test:
-        try:
-            exec(f"from {module} import {class_name}")
-            print(f"✅ {module}.{class_name}: OK")
-        except Exception as e:
-            print(f"❌ {module}.{class_name}: {e}")
-            all_passed = False
-    
-    return all_passed
-
-if __name__ == "__main__":
-    print("=== STARTING MODULE TESTS ===")
-    core_ok = test_core_module()
-    web_ok = test_web_module()
-    imports_ok = test_import_all_modules()
-    
-    if all([core_ok, web_ok, imports_ok]):
-        print("=== ALL TESTS PASSED ===")
-    else:
-        print("=== SOME TESTS FAILED ===")
-        exit(1)
+    assert app_instance is not None
+
+@pytest.mark.parametrize("module,class_name", [
+    ("src.bots.BaseTradingBot", "BaseTradingBot"),
+    ("src.data.MarketData", "MarketDataProcessor"),
+    ("src.execution.OrderExecutor", "OrderExecutor"),
+    ("src.risk.RiskManager", "RiskManager"),
+])
+def test_import_module(module, class_name):
+    """Test importing a class from its defining module"""
+    module_obj = importlib.import_module(module)
+    assert isinstance(getattr(module_obj, class_name, None), type), f"{module}.{class_name} missing"
+
+def test_bots_module():
+    bot = BaseTradingBot("TestBot")
+    assert bot.name == "TestBot"
+    assert bot.start() == True
+
+def test_data_module():
+    data = MarketData()
+    result = data.connect_exchange("binance")
+    assert result == True
+
+def test_execution_module():
+    executor = OrderExecutor()
+    assert executor.exchange_name == "binance"
+
+def test_risk_module():
+    risk = RiskManager()
+    assert "max_position_size" in risk.config
+
+def test_websocket_dashboard_import():
+    """Test the dashboard module exposes its entry point and candle buffer"""
+    from src.websocket import WebSocketDashboard
+    assert callable(WebSocketDashboard.get_dashboard)
+    assert isinstance(WebSocketDashboard.CandleBuffer, type)
@@ -3,29 +3,17 @@ Tests for web API
 """
 
 import pytest
-from fastapi.testclient import TestClient
-from src.web.api import app
 
-client = TestClient(app)
+# All tests share the session event loop that owns the aclient fixture
+pytestmark = pytest.mark.asyncio(loop_scope="session")
 
-def test_root_endpoint():
-    """Test root endpoint"""
-    response = client.get("/")
+@pytest.mark.parametrize("path,check", [
+    ("/", lambda data: data == {"message": "Trading Platform API"}),
+    ("/health", lambda data: data["status"] == "healthy" and data["version"] == "0.1.0"),
+    ("/markets", lambda data: isinstance(data["markets"], list)),
+], ids=["root", "health", "markets"])
+async def test_endpoint(aclient, path, check):
+    """Test GET endpoint returns 200 and the expected payload"""
+    response = await aclient.get(path)
     assert response.status_code == 200
-    assert response.json() == {"message": "Trading Platform API"}
-
-def test_health_endpoint():
-    """Test health endpoint"""
-    response = client.get("/health")
-    assert response.status_code == 200
-    data = response.json()
-    assert data["status"] == "healthy"
-    assert data["version"] == "0.1.0"
-
-def test_markets_endpoint():
-    """Test markets endpoint"""
-    response = client.get("/markets")
-    assert response.status_code == 200
-    data = response.json()
-    assert "markets" in data
-    assert isinstance(data["markets"], list)
+    assert check(response.json()), response.json()
@@ -0,0 +1,233 @@
+"""
+Tests for the market data streamer and dashboard buffers
+"""
+
+import asyncio
+import socket
+import sys
+import threading
+import numpy as np
+import pytest
+
+from src.websocket.MarketStreamer import BATCH_WINDOW, MarketStreamer, TradeBuffer
+from src.websocket.WebSocketDashboard import CandleBuffer, _build_candlestick_figure
+
+def binance_kline(ts, close, closed=False):
+    return {'stream': 'btcusdt@kline_1m', 'data': {
+        'e': 'kline', 's': 'BTCUSDT',
+        'k': {'t': ts, 'o': '100', 'h': '110', 'l': '90', 'c': str(close),
+              'v': '5', 'x': closed, 'i': '1m'}}}
+
+def binance_ticker(price):
+    return {'stream': 'btcusdt@ticker', 'data': {
+        'e': '24hrTicker', 's': 'BTCUSDT', 'c': str(price),
+        'h': '110', 'l': '90', 'v': '1000', 'p': '2', 'P': '1.5'}}
+
+def bybit_ticker(price):
+    return {'topic': 'tickers.BTCUSDT', 'data': {
+        'symbol': 'BTCUSDT', 'lastPrice': str(price), 'highPrice24h': '110',
+        'lowPrice24h': '90', 'volume24h': '1000', 'price24hPcnt': '0.02'}}
+
+def trade(i):
+    return {'timestamp_ms': i, 'price': float(i), 'quantity': 1.0,
+            'is_buyer_maker': i % 2 == 0, 'time_str': str(i)}
+
+@pytest.fixture
+def streamer():
+    """Streamer fed directly by the test, without a connection thread"""
+    streamer = MarketStreamer()
+    streamer.running = True
+    yield streamer
+    streamer.running = False
+
+async def flush():
+    """Let call_soon callbacks, queue workers and batch flushes run"""
+    await asyncio.sleep(BATCH_WINDOW * 3)
+
+@pytest.mark.asyncio
+async def test_subscribers_receive_candles(streamer):
+    """Test sync, async and batch subscribers receive kline updates"""
+    streamer.event_loop = asyncio.get_running_loop()
+    sync_got, async_got, batches = [], [], []
+
+    async def on_candle(candle):
+        async_got.append(candle['close'])
+
+    streamer.subscribe('binance', 'btcusdt', 'kline_1m', lambda c: sync_got.append(c['close']))
+    streamer.subscribe('binance', 'btcusdt', 'kline_1m', on_candle)
+    streamer.subscribe('binance', 'btcusdt', 'kline_1m', batches.append, batch=True)
+
+    for close in (101, 102, 103):
+        await streamer._handle_binance_message(binance_kline(60000, close))
+    await flush()
+
+    assert sync_got == [101.0, 102.0, 103.0]
+    assert async_got == [101.0, 102.0, 103.0]
+    assert [[c['close'] for c in batch] for batch in batches] == [[101.0, 102.0, 103.0]]
+
+    latest = streamer.get_latest_data('binance', 'btcusdt', 'kline_1m')
+    assert [c['close'] for c in latest] == [103.0]
+
+@pytest.mark.asyncio
+async def test_tickers_are_kept_per_exchange(streamer):
+    """Test Binance and Bybit tickers for one symbol do not overwrite each other"""
+    streamer.event_loop = asyncio.get_running_loop()
+    binance_got, bybit_got = [], []
+    streamer.subscribe('binance', 'btcusdt', 'ticker', binance_got.append)
+    streamer.subscribe('bybit', 'btcusdt', 'tickers', bybit_got.append)
+
+    await streamer._handle_binance_message(binance_ticker(50000))
+    await streamer._handle_bybit_message(bybit_ticker(50100))
+    await flush()
+
+    assert [t['last_price'] for t in binance_got] == [50000.0]
+    assert [t['last_price'] for t in bybit_got] == [50100.0]
+    assert streamer.get_latest_data('binance', 'btcusdt', 'ticker')['price_change_percent'] == 1.5
+    bybit = streamer.get_latest_data('bybit', 'btcusdt', 'tickers')
+    assert bybit['last_price'] == 50100.0
+    assert bybit['price_change_percent'] == pytest.approx(2.0)
+
+@pytest.mark.asyncio
+async def test_trade_ticker_does_not_throttle_24h_ticker(streamer):
+    """Test a 24hrTicker right after a trade still reaches ticker subscribers"""
+    streamer.event_loop = asyncio.get_running_loop()
+    got = []
+    streamer.subscribe('binance', 'btcusdt', 'ticker', got.append)
+
+    for i in range(3):
+        await streamer._handle_binance_message({'stream': 'btcusdt@trade', 'data': {
+            'e': 'trade', 's': 'BTCUSDT', 'p': str(100 + i), 'q': '1',
+            'T': 1700000000000 + i, 'm': False}})
+    await streamer._handle_binance_message(binance_ticker(50000))
+    await flush()
+
+    assert [t['last_price'] for t in got] == [100.0, 50000.0]
+    assert got[-1]['price_change_percent'] == 1.5
+
+@pytest.mark.asyncio
+async def test_latest_trades_and_order_book(streamer):
+    """Test get_latest_data returns trade records and immutable order book snapshots"""
+    streamer.event_loop = asyncio.get_running_loop()
+    for i in range(3):
+        await streamer._handle_binance_message({'stream': 'btcusdt@trade', 'data': {
+            'e': 'trade', 's': 'BTCUSDT', 'p': str(100 + i), 'q': '1',
+            'T': 1700000000000 + i * 1000, 'm': False}})
+
+    trades = streamer.get_latest_data('binance', 'btcusdt', 'trade', limit=2)
+    assert [t['price'] for t in trades] == [101.0, 102.0]
+    assert trades[0]['time_str'] == '22:13:21'
+    assert streamer.cache_key('binance', 'btcusdt', 'trade') == 'binance_trades_btcusdt'
+
+    depth = {'stream': 'btcusdt@depth20@100ms',
+             'data': {'lastUpdateId': 1, 'bids': [['1', '2']], 'asks': [['3', '4']]}}
+    await streamer._handle_binance_message(depth)
+    book = streamer.get_latest_data('binance', 'btcusdt', 'depth20@100ms')
+    bids = book['bids']
+    depth['data'].update(lastUpdateId=2, bids=[['9', '9']])
+    await streamer._handle_binance_message(depth)
+    assert bids.tolist() == [[1.0, 2.0]]
+    assert book['last_update_id'] == 1
+    latest = streamer.get_latest_data('binance', 'btcusdt', 'depth20@100ms')
+    assert latest['bids'].tolist() == [[9.0, 9.0]]
+    assert latest['asks'].tolist() == [[3.0, 4.0]]
+    assert latest['last_update_id'] == 2
+
+@pytest.mark.parametrize("tcp_nodelay", [True, False])
+def test_tune_socket_applies_tcp_nodelay(streamer, tcp_nodelay):
+    """Test _tune_socket writes the tcp_nodelay flag to the socket either way"""
+    class Transport:
+        def get_extra_info(self, name):
+            return sock
+
+    class Connection:
+        transport = Transport()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(not tcp_nodelay))
+        streamer.tcp_nodelay = tcp_nodelay
+        streamer._tune_socket(Connection())
+        assert bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)) is tcp_nodelay
+
+@pytest.mark.parametrize("count,limit,expected", [
+    (3, 10, [0, 1, 2]),
+    (6, 10, [2, 3, 4, 5]),
+    (6, 2, [4, 5]),
+    (9, 3, [6, 7, 8]),
+], ids=["partial", "wrapped", "wrapped-limit", "wrapped-across-end"])
+def test_trade_buffer_tail(count, limit, expected):
+    """Test TradeBuffer.tail returns the newest trades in order across wraparound"""
+    buffer = TradeBuffer(size=4)
+    for i in range(count):
+        buffer.append(trade(i))
+    tail = buffer.tail(limit)
+    assert tail['timestamp_ms'].tolist() == expected
+    assert tail['time_str'].tolist() == [str(i) for i in expected]
+    assert [r['price'] for r in buffer.records(limit)] == [float(i) for i in expected]
+
+@pytest.mark.parametrize("count,expected", [
+    (2, [0, 1]),
+    (3, [0, 1, 2]),
+    (5, [2, 3, 4]),
+    (7, [4, 5, 6]),
+], ids=["partial", "full", "wrapped", "wrapped-twice"])
+def test_candle_buffer_columns(count, expected):
+    """Test CandleBuffer.columns returns candles in chronological order across wraparound"""
+    buffer = CandleBuffer(size=3)
+    for i in range(count):
+        buffer.update({'timestamp_ms': i, 'open': i, 'high': i, 'low': i,
+                       'close': i, 'is_closed': True})
+    ts, opens, highs, lows, closes = buffer.columns()
+    assert ts.tolist() == expected
+    np.testing.assert_array_equal(closes, np.array(expected, dtype=np.float64))
+    assert len(buffer) == len(expected)
+
+def test_candle_buffer_columns_same_length_during_writes():
+    """Test CandleBuffer.columns returns equal-length columns while another thread appends"""
+    buffer = CandleBuffer(size=1000)
+
+    def write():
+        for i in range(20000):
+            buffer.update({'timestamp_ms': i, 'open': i, 'high': i, 'low': i,
+                           'close': i, 'is_closed': True})
+
+    # Switch threads often so writes land in the middle of columns()
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        writer = threading.Thread(target=write)
+        writer.start()
+        lengths = set()
+        while writer.is_alive():
+            lengths.add(tuple(len(column) for column in buffer.columns()))
+        writer.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert all(len(set(item)) == 1 for item in lengths), lengths
+
+def test_candle_buffer_updates_open_candle():
+    """Test an update with the same timestamp replaces the last candle"""
+    buffer = CandleBuffer(size=3)
+    buffer.update_batch([
+        {'timestamp_ms': 1, 'open': 1, 'high': 1, 'low': 1, 'close': 1, 'is_closed': False},
+        {'timestamp_ms': 1, 'open': 1, 'high': 2, 'low': 1, 'close': 2, 'is_closed': True},
+    ])
+    ts, _, highs, _, closes = buffer.columns()
+    assert ts.tolist() == [1]
+    assert closes.tolist() == [2.0]
+
+def test_candlestick_figure_includes_open_candle():
+    """Test the chart trace holds float OHLC arrays with the open candle appended"""
+    buffer = CandleBuffer(size=5)
+    for i in range(3):
+        buffer.update({'timestamp_ms': i * 60000, 'open': i, 'high': i + 1, 'low': i,
+                       'close': i + 0.5, 'is_closed': True})
+    buffer.update({'timestamp_ms': 180000, 'open': 5, 'high': 6, 'low': 4,
+                   'close': 5.5, 'is_closed': False})
+
+    trace = _build_candlestick_figure('btcusdt', None, buffer).data[0]
+    assert isinstance(trace.open, np.ndarray)
+    assert trace.open.dtype == np.float64
+    assert trace.open.tolist() == [0.0, 1.0, 2.0, 5.0]
+    assert trace.close.tolist() == [0.5, 1.5, 2.5, 5.5]
+    assert len(trace.x) == 4